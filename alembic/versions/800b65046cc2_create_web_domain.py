@@ -29,10 +29,10 @@ def upgrade():
     )
 
     connection = op.get_bind()
-    results = connection.execute(sa.select([
+    results = connection.execute(sa.select(
         t_servers.c.domain,
         t_servers.c.web_domain,
-    ])).fetchall()
+    )).fetchall()
 
     for domain, _web_domain in results:
         connection.execute(
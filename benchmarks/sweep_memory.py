@@ -0,0 +1,66 @@
+"""Peak memory of streaming a sweep over many servers.
+
+Seeds a temporary sqlite database and reports the tracemalloc peak of
+`run_bounded(noop, iter_servers(...))`, next to loading every `Server`
+at once as sweeps used to. Usage::
+
+    python benchmarks/sweep_memory.py --servers 100000
+"""
+import argparse
+import pathlib
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from mastodon_update_bot.engine import get_session, init_db  # noqa: E402
+from mastodon_update_bot.models import Server, iter_servers  # noqa: E402
+from mastodon_update_bot.workers import run_bounded  # noqa: E402
+
+
+def noop(domain, web_domain):
+    pass
+
+
+def measure(func) -> tuple[float, int]:
+    tracemalloc.start()
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--servers', type=int, default=100_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        url = f'sqlite:///{directory}/benchmark.db'
+        init_db(url)
+        Session = get_session(url)
+        with Session() as session:
+            session.execute(Server.__table__.insert(), [
+                {'domain': f'server{index:07}.example', 'web_domain': f'server{index:07}.example'}
+                for index in range(args.servers)
+            ])
+            session.commit()
+
+        def stream():
+            run_bounded(noop, iter_servers(Session))
+
+        def load_all():
+            with Session() as session:
+                run_bounded(noop, [(server.domain, server.web_domain) for server in session.query(Server).all()])
+
+        for name, func in (('iter_servers', stream), ('query().all()', load_all)):
+            elapsed, peak = measure(func)
+            print(f'{name:>14}: {args.servers} servers in {elapsed:.2f}s, peak {peak / 1024 / 1024:.2f} MiB')
+
+
+if __name__ == '__main__':
+    main()
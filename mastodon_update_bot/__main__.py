@@ -10,6 +10,8 @@ if __name__ == '__main__':
     token = os.getenv('MASTODON_ACCESS_TOKEN', '')
     debug = os.getenv('DEBUG', 'False')
     debug = False if debug.lower() in ('false', '0', 'no') else True
+    unreachable_notice_days = int(os.getenv('UNREACHABLE_NOTICE_DAYS', '0'))
 
-    mastodon_manager = MastodonManager(db_url, domain, token, debug=debug)
+    mastodon_manager = MastodonManager(
+        db_url, domain, token, debug=debug, unreachable_notice_days=unreachable_notice_days)
     mastodon_manager.run()
@@ -1,8 +1,15 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from .models import Base
 
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
 
 def get_session(url: str):
     engine = create_engine(url)
@@ -11,6 +18,31 @@ def get_session(url: str):
     return session
 
 
+def get_async_session(url: str):
+    engine = create_async_engine(async_url(url))
+    session = async_sessionmaker(engine, expire_on_commit=False)
+
+    return session
+
+
+def async_url(url: str) -> str:
+    """Swap the sync DBAPI driver of `url` for its asyncio counterpart
+    (asyncpg for postgres, aiosqlite for sqlite).
+    """
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend in ASYNC_DRIVERS:
+        url = url.set(drivername=ASYNC_DRIVERS[backend])
+    return url.render_as_string(hide_password=False)
+
+
 def init_db(url: str):
     engine = create_engine(url)
     Base.metadata.create_all(engine)
+
+
+async def init_db_async(url: str):
+    engine = create_async_engine(async_url(url))
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await engine.dispose()
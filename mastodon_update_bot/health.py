@@ -0,0 +1,90 @@
+"""Per-host circuit breaker for servers that keep failing to respond.
+
+The breaker is driven by the instance API fetch of `check_and_notify`
+only, so a working TLS handshake cannot mask a broken API or vice versa.
+After `FAILURE_THRESHOLD` consecutive failures a server is skipped until
+`Server.retry_at`, which backs off exponentially up to `MAX_BACKOFF`.
+A successful fetch closes the breaker again.
+"""
+import datetime
+import os
+import socket
+import ssl
+
+import requests
+
+from .models import FailureReason, ServerFailure
+
+FAILURE_THRESHOLD = int(os.getenv('FAILURE_THRESHOLD', '3'))
+BASE_BACKOFF = datetime.timedelta(hours=1)
+MAX_BACKOFF = datetime.timedelta(days=7)
+
+
+def classify(exc: BaseException) -> FailureReason:
+    if isinstance(exc, (requests.Timeout, TimeoutError)):
+        return FailureReason.timeout
+    if isinstance(exc, (requests.exceptions.SSLError, ssl.SSLError, ssl.CertificateError)):
+        return FailureReason.tls
+    if any(_is_dns_error(cause) for cause in _causes(exc)):
+        return FailureReason.dns
+    if isinstance(exc, requests.HTTPError):
+        return FailureReason.http
+    if isinstance(exc, (ValueError, KeyError, TypeError)):
+        return FailureReason.json
+    if isinstance(exc, OSError):
+        return FailureReason.connect
+    return FailureReason.other
+
+
+def _causes(exc: BaseException):
+    """Walk the exceptions wrapped by requests and urllib3."""
+    seen = set()
+    stack = [exc]
+    while stack:
+        exc = stack.pop()
+        if not isinstance(exc, BaseException) or id(exc) in seen:
+            continue
+        seen.add(id(exc))
+        yield exc
+        stack.extend((exc.__cause__, exc.__context__, getattr(exc, 'reason', None), *exc.args))
+
+
+def _is_dns_error(exc: BaseException) -> bool:
+    return isinstance(exc, socket.gaierror) or type(exc).__name__ == 'NameResolutionError'
+
+
+def is_open(server, now: datetime.datetime) -> bool:
+    """Whether probes to `server` should be skipped for now."""
+    return server.retry_at is not None and server.retry_at > now
+
+
+def backoff(failures: int) -> datetime.timedelta:
+    exponent = max(failures - FAILURE_THRESHOLD, 0)
+    return min(BASE_BACKOFF * 2 ** min(exponent, 16), MAX_BACKOFF)
+
+
+def record_success(server):
+    server.failures = 0
+    server.retry_at = None
+    server.unreachable_since = None
+    server.last_unreachable_notified = None
+
+
+def count_failure(server, now: datetime.datetime):
+    """Advance the breaker of `server` by one failure."""
+    server.failures = (server.failures or 0) + 1
+    if server.unreachable_since is None:
+        server.unreachable_since = now
+    if server.failures >= FAILURE_THRESHOLD:
+        server.retry_at = now + backoff(server.failures)
+
+
+def record_failure(session, server, reason: FailureReason, now: datetime.datetime):
+    count_failure(server, now)
+
+    failure = session.get(ServerFailure, (server.domain, reason))
+    if failure is None:
+        failure = ServerFailure(domain=server.domain, reason=reason, count=0)
+        session.add(failure)
+    failure.count += 1
+    failure.last_failed = now
@@ -1,193 +1,284 @@
 import datetime
 import functools
 import logging
-import math
+import signal
 import socket
 import ssl
 import time
 import traceback
-from multiprocessing.pool import ThreadPool
 
 import feedparser
 import mastodon
 import requests
 import schedule
-from packaging import version
-from sqlalchemy import func
+from sqlalchemy import select
 
+from . import health, policy
 from .engine import get_session
 from .mastodon import MastodonStreamListener
-from .models import Mastodon, Server, Admin, UpdateType
+from .models import (
+    Mastodon, Server, Sweep, UpdateType, FailureReason, claim_notification, iter_servers, record_version,
+)
+from .profiling import profiler
+from .registry import Registry
+from .workers import Stop, run_bounded
+
+REQUEST_TIMEOUT = 10
+# Seconds in-flight checks get to finish after SIGTERM
+SHUTDOWN_DEADLINE = 20
+# Seconds between sweep progress writes
+CHECKPOINT_INTERVAL = 10
 
 
 class MastodonManager():
 
-    def __init__(self, db_url: str, domain: str, token: str, debug=False):
+    def __init__(self, db_url: str, domain: str, token: str, debug=False, unreachable_notice_days=0,
+                 clock=policy.utcnow):
         self.Session = get_session(db_url)
         self.logger = logging.getLogger(__name__)
         self.debug = debug
+        self.clock = clock
+        self.stopping = Stop()
+        self.unreachable_notice = (
+            datetime.timedelta(days=unreachable_notice_days) if unreachable_notice_days else None)
+
+        # Threads per sweep, defaults to the number of CPUs
+        self.workers = None
+        self.registry = Registry()
 
         if self.debug:
             self.logger.warning('Running on DEBUG mode')
 
+        self.connect(domain, token)
+
+    def connect(self, domain: str, token: str):
         self.api = mastodon.Mastodon(
             api_base_url=f'https://{domain}/',
             access_token=token
         )
 
-        self.stream_listener = MastodonStreamListener(self.api, self.Session, debug=debug)
+        self.stream_listener = MastodonStreamListener(
+            self.api, self.Session, self.registry, debug=self.debug, clock=self.utcnow)
 
     def should_notify(self, last_notified: datetime.datetime):
+        return policy.should_notify(self.registry.release_date, last_notified, self.utcnow())
 
-        session = self.Session()
+    def should_notify_tls(self, last_notified: datetime.datetime):
+        return policy.should_notify_tls(last_notified, self.utcnow())
+
+    def fetch_release(self) -> tuple[str, str]:
+        """Latest mastodon release as (version, updated)."""
+        feed = feedparser.parse('https://github.com/mastodon/mastodon/releases.atom')
+        latest_release = feed.entries[0]
+        return latest_release.title, latest_release.updated
 
-        release_date = session.query(Mastodon).one().updated
-        # Days from release to now
-        days_passed = (self.utcnow() - release_date).days
+    def fetch_version(self, web_domain: str) -> str:
+        response = requests.get(f'https://{web_domain}/api/v2/instance', timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response.json()['version']
 
-        if last_notified is None:
-            return days_passed >= 1
+    def fetch_tls_expires(self, domain: str, web_domain: str) -> datetime.datetime:
+        ssl_date_fmt = r'%b %d %H:%M:%S %Y %Z'
 
-        # Days from release to last notified
-        days_notified = (last_notified - release_date).days
-        self.logger.debug(f'Days notified: {days_notified}, passed: {days_passed}')
+        context = ssl.create_default_context()
+        with socket.create_connection((domain, 443), timeout=REQUEST_TIMEOUT) as sock:
+            with context.wrap_socket(sock, server_hostname=web_domain) as ssock:
+                ssl_info = ssock.getpeercert()
 
-        # 0, 1, 2, 4, 8
-        try:
-            notified_level = math.log(days_notified, 2) if days_notified else -1
-        except ValueError:
-            notified_level = -1
-        passed_level = math.log(days_passed, 2) if days_passed else -1
+        expires = datetime.datetime.strptime(ssl_info['notAfter'], ssl_date_fmt)
+        return expires.replace(tzinfo=datetime.timezone.utc)
 
-        session.close()
+    # Everything the checks store goes through the methods below, so the
+    # simulator can keep the same state in memory.
 
-        return passed_level - notified_level >= 1 and days_passed >= 1
+    def load_release(self) -> tuple[str, datetime.datetime] | None:
+        """Stored release as (version, updated)."""
+        with self.Session() as session:
+            return session.execute(select(Mastodon.version, Mastodon.updated)).first()
 
-    def should_notify_tls(self, last_notified: datetime.datetime):
-        if last_notified is None:
-            return True
+    def save_release(self, release: str, updated):
+        with self.Session() as session:
+            mastodon = session.query(Mastodon).first() or Mastodon()
+            mastodon.version = release
+            mastodon.updated = updated
+            session.add(mastodon)
+            session.commit()
 
-        days_notified = (self.utcnow() - last_notified).days
-        return days_notified >= 1
+    def load_server(self, domain: str) -> Server | None:
+        """The stored server, detached from its session."""
+        with self.Session() as session:
+            return session.get(Server, domain)
+
+    def save_version(self, domain: str, server_version: str) -> datetime.datetime | None:
+        """Store a successful fetch, which also closes the breaker.
+        :return: `last_notified` as stored afterwards
+        """
+        with self.Session() as session:
+            record_version(session, domain, server_version)
+            server = session.get(Server, domain)
+            if server is None:
+                return None
+            server.last_fetched = self.utcnow()
+            health.record_success(server)
+            session.commit()
+            return server.last_notified
+
+    def save_tls_expires(self, domain: str, expires: datetime.datetime) -> datetime.datetime | None:
+        """:return: `last_tls_notified` as stored afterwards"""
+        with self.Session() as session:
+            server = session.get(Server, domain)
+            if server is None:
+                return None
+            server.tls_expires = expires
+            session.commit()
+            return server.last_tls_notified
+
+    def save_failure(self, domain: str, reason: FailureReason, now: datetime.datetime) -> Server | None:
+        """Count a failure of `reason` against the server.
+        :return: the server as stored afterwards, detached from its session
+        """
+        with self.Session() as session:
+            server = session.get(Server, domain)
+            if server is None:
+                return None
+            health.record_failure(session, server, reason, now)
+            session.commit()
+            session.refresh(server)
+            return server
+
+    def claim_notification(self, domain: str, column, last_notified) -> bool:
+        with self.Session() as session:
+            return claim_notification(session, domain, column, last_notified, self.utcnow())
 
     def check_mastodon_release(self):
         """
         Check latest mastodon release.
         Return (version: str, is_new: bool)
         """
-        feed = feedparser.parse('https://github.com/mastodon/mastodon/releases.atom')
-        latest_release = feed.entries[0]
-
-        current_version = latest_release.title
-        current_updated = latest_release.updated
+        current_version, current_updated = self.fetch_release()
 
-        session = self.Session()
-        is_new = False
-        try:
-            mastodon = session.query(Mastodon).one()
-            old_version = version.parse(mastodon.version)
-            new_version = version.parse(current_version)
-
-            if old_version < new_version:
-                is_new = True
-                mastodon.version = current_version
-                mastodon.updated = current_updated
-                session.commit()
-        except Exception:
-            mastodon = Mastodon()
-            mastodon.version = current_version
-            mastodon.updated = current_updated
-            session.add(mastodon)
-            session.commit()
+        stored = self.load_release()
+        is_new = stored is not None and policy.parse_version(stored[0]) < policy.parse_version(current_version)
+        if stored is None or is_new:
+            self.save_release(current_version, current_updated)
+            stored = self.load_release()
 
-        session.close()
+        self.registry.set_release(*stored)
 
         return current_version, is_new
 
     def check_and_notify(self, domain: str, web_domain: str, release: str):
-        session = self.Session()
-        try:
-            server = session.query(Server).filter(Server.domain == domain).one()
-            self.logger.debug(f'Checking {server.domain}')
-            server_version = requests.get(f'https://{web_domain}/api/v2/instance').json()['version']
-
-            if server.version != server_version:
-                server.last_notified = None
+        server = self.load_server(domain)
+        if server is None:
+            return
+        if health.is_open(server, self.utcnow()):
+            self.logger.debug(f'Skipping {domain} until {server.retry_at}')
+            return
 
-            server.last_fetched = func.now()
-            server.version = server_version
-        except Exception:
-            self.logger.error(traceback.format_exc())
-            self.logger.error(f'Error while checking {web_domain}')
-            session.close()
+        self.logger.debug(f'Checking {domain}')
+        try:
+            server_version = self.fetch_version(web_domain)
+            last_notified = self.save_version(domain, server_version)
+        except Exception as e:
+            self.record_failure(domain, e, f'Error while checking {web_domain}')
             return
 
-        if version.parse(server_version) < version.parse(release):
+        if policy.parse_version(server_version) < policy.parse_version(release):
             self.logger.info(f'{domain} is still {server_version}')
-            if self.should_notify(server.last_notified):
+            if not self.should_notify(last_notified):
+                self.logger.debug(f'Not notifying to {domain}')
+            elif not self.claim_notification(domain, Server.last_notified, last_notified):
+                self.logger.info(f'{domain} is already notified by another sweep')
+            else:
                 self.logger.info(f'Notify to {domain}')
                 self.notify_admins(domain, release)
-                server.last_notified = func.now()
-            else:
-                self.logger.debug(f'Not notifying to {domain}')
-
-        session.commit()
-        session.close()
 
+    @profiler('job')
     def job(self):
         self.logger.debug('Starting job')
-        session = self.Session()
         release, is_new = self.check_mastodon_release()
         self.logger.info(f'Latest release: {release}')
         if is_new:
             self.logger.info(f'New version: {release}')
             self.notify_new_version(release)
         else:
-            pool = ThreadPool()
-            pool.starmap(self.check_and_notify, (
-                (server.domain, server.web_domain, release)
-                for server in session.query(Server).all()
-            ))
-            pool.close()
-            pool.join()
-
-        session.close()
+            self.sweep('job', release)
 
     def check_tls_and_notify(self, domain: str, web_domain: str):
-        ssl_date_fmt = r'%b %d %H:%M:%S %Y %Z'
+        server = self.load_server(domain)
+        if server is None:
+            return
+        if health.is_open(server, self.utcnow()):
+            self.logger.debug(f'Skipping SSL check on {web_domain} until {server.retry_at}')
+            return
+
+        try:
+            expires = self.fetch_tls_expires(domain, web_domain)
+        except Exception as e:
+            # Only the instance API fetch in check_and_notify drives the breaker
+            self.log_failure(e, f'Error while checking SSL on {web_domain}')
+            return
+
+        days_left = (expires - self.utcnow()).days
+        self.logger.debug(f'{web_domain} SSL expires in {days_left} days')
 
-        session = self.Session()
         try:
-            server = session.query(Server).filter(Server.domain == domain).one()
-
-            context = ssl.create_default_context()
-            with socket.create_connection((domain, 443)) as sock:
-                with context.wrap_socket(sock, server_hostname=web_domain) as ssock:
-                    ssl_info = ssock.getpeercert()
-                    expires = datetime.datetime.strptime(ssl_info['notAfter'], ssl_date_fmt)
-                    days_left = (expires - datetime.datetime.utcnow()).days
-                    self.logger.debug(f'{web_domain} SSL expires in {days_left} days')
-
-                    if days_left <= 7 and self.should_notify_tls(server.last_tls_notified):
-                        self.notify_tls_expire(domain, days_left)
-                        server.last_tls_notified = func.now()
-                        session.commit()
+            last_notified = self.save_tls_expires(domain, expires)
+            if (days_left <= 7 and self.should_notify_tls(last_notified)
+                    and self.claim_notification(domain, Server.last_tls_notified, last_notified)):
+                self.notify_tls_expire(domain, days_left)
         except Exception:
             self.logger.error(traceback.format_exc())
             self.logger.error(f'Error while checking SSL on {web_domain}')
-            session.rollback()
+
+    def record_failure(self, domain: str, error: Exception, message: str):
+        """Count a failed instance API fetch against the server's circuit breaker.
+        The traceback is only logged on DEBUG since dead hosts fail every sweep.
+        """
+        reason = self.log_failure(error, message)
+
+        now = self.utcnow()
+        server = self.save_failure(domain, reason, now)
+        if server is None:
+            return
+
+        if server.retry_at is not None:
+            self.logger.info(f'{domain} failed {server.failures} times in a row, retrying at {server.retry_at}')
+
+        if self.unreachable_notice is None or server.last_unreachable_notified is not None:
             return
-        finally:
-            session.close()
+        days_unreachable = (now - server.unreachable_since).days
+        if now - server.unreachable_since < self.unreachable_notice:
+            return
+        if self.claim_notification(domain, Server.last_unreachable_notified, None):
+            self.notify_unreachable(domain, days_unreachable, reason)
+
+    def log_failure(self, error: Exception, message: str) -> FailureReason:
+        """Log a failed probe on one line, as dead hosts fail every sweep.
+        The traceback is only logged on DEBUG.
+        """
+        reason = health.classify(error)
+        self.logger.debug(traceback.format_exc())
+        self.logger.warning(f'{message}: [{reason.value}] {error}')
+        return reason
+
+    def notify_unreachable(self, domain: str, days: int, reason: FailureReason):
+        self.logger.info(f'Notify unreachable to {domain}')
+
+        for admin in self.registry.admins_of(domain):
+            self.post(
+                f'@{admin.acct}\n'
+                f'{domain} 서버에 {days}일째 접속할 수 없어요. ({reason.value})',
+                visibility='direct',
+                language='ko'
+            )
 
     def notify_tls_expire(self, domain: str, days_left: int):
         self.logger.info(f'Notify SSL expire to {domain}')
-        session = self.Session()
-        server = session.query(Server).filter_by(domain=domain).one()
 
         visibility = 'public' if days_left < 3 else 'private'
 
-        for admin in server.admins:
+        for admin in self.registry.admins_of(domain):
             self.post(
                 f'@{admin.acct}\n'
                 f'{domain} 인증서가 {days_left}일 후에 만료됩니다.',
@@ -195,22 +286,94 @@ class MastodonManager():
                 language='ko'
             )
 
-        session.close()
-
+    @profiler('ssl_check_job')
     def ssl_check_job(self):
         self.logger.debug('Starting ssl check job')
+        self.sweep('ssl_check_job')
+
+    def sweep(self, kind: str, release: str | None = None, sweep_id: int | None = None):
+        """Run the check of `kind` over every server, checkpointing progress
+        so that an interrupted sweep can be picked up by `resume_sweeps`.
+        """
+        if kind == 'job':
+            check, extra = self.check_and_notify, (release,)
+        else:
+            check, extra = self.check_tls_and_notify, ()
+
+        session = self.Session()
+        if sweep_id is None:
+            # A new sweep supersedes any unfinished one
+            session.query(Sweep).filter_by(kind=kind, finished=None).update({Sweep.finished: self.utcnow()})
+            sweep = Sweep(kind=kind, release=release, started=self.utcnow())
+            session.add(sweep)
+            session.commit()
+        else:
+            sweep = session.get(Sweep, sweep_id)
+        sweep_id, after = sweep.id, sweep.last_domain
+        session.close()
+
+        checkpointed = time.monotonic()
+
+        def on_progress(args):
+            nonlocal checkpointed
+            if time.monotonic() - checkpointed >= CHECKPOINT_INTERVAL:
+                checkpointed = time.monotonic()
+                self.checkpoint(sweep_id, args[0])
+
+        last = run_bounded(
+            check,
+            ((domain, web_domain, *extra) for domain, web_domain in iter_servers(self.Session, after=after)),
+            workers=self.workers, stop=self.stopping, deadline=SHUTDOWN_DEADLINE, on_progress=on_progress,
+        )
+        last_domain = last[0] if last else after
+
+        if self.stopping.is_set():
+            self.logger.info(f'Interrupted {kind} sweep {sweep_id} after {last_domain}')
+            self.checkpoint(sweep_id, last_domain)
+        else:
+            self.checkpoint(sweep_id, last_domain, finished=True)
+
+    def checkpoint(self, sweep_id: int, last_domain: str | None, finished=False):
         session = self.Session()
-        pool = ThreadPool()
-        pool.starmap(self.check_tls_and_notify, (
-            (server.domain, server.web_domain)
-            for server in session.query(Server).all()
-        ))
-        pool.close()
-        pool.join()
+        sweep = session.get(Sweep, sweep_id)
+        sweep.last_domain = last_domain
+        if finished:
+            sweep.finished = self.utcnow()
+        session.commit()
+        session.close()
+
+    def resume_sweeps(self):
+        """Finish the sweeps interrupted by the last shutdown right away,
+        instead of waiting for their next scheduled run.
+        """
+        session = self.Session()
+        sweeps = session.query(Sweep).filter_by(finished=None).order_by(Sweep.started.desc()).all()
+        interrupted = {}
+        for sweep in sweeps:
+            if sweep.kind in interrupted:
+                sweep.finished = self.utcnow()
+            else:
+                interrupted[sweep.kind] = (sweep.id, sweep.release, sweep.last_domain)
+        session.commit()
+        session.close()
+
+        for kind, (sweep_id, release, last_domain) in interrupted.items():
+            if self.stopping.is_set():
+                return
+            self.logger.info(f'Resuming {kind} sweep {sweep_id} after {last_domain}')
+            self.sweep(kind, release, sweep_id=sweep_id)
+
+    def shutdown(self, signum, frame):
+        self.logger.info('Shutting down')
+        self.stopping.set()
 
     def run(self):
         me = self.api.account_verify_credentials()
         self.logger.info(f'I am {me.acct}')
+        profiler.install_signal_handler()
+        signal.signal(signal.SIGTERM, self.shutdown)
+        self.logger.info('Loading registry')
+        self.registry.load(self.Session)
         self.logger.info('Starting mastodon stream')
         self.stream_listener.stream_user(run_async=True, reconnect_async=True)
 
@@ -221,19 +384,23 @@ class MastodonManager():
         else:
             schedule.every(1).hours.do(self.job)
             schedule.every(2).hours.do(self.ssl_check_job)
+        schedule.every(10).minutes.do(self.registry.reconcile, self.Session)
+
+        self.resume_sweeps()
+
         # schedule.run_all()
-        while True:
+        while not self.stopping.is_set():
             schedule.run_pending()
-            time.sleep(5)
+            self.stopping.wait(5)
+
+        self.logger.info('Stopped')
 
     def notify_admins(self, domain, release):
-        session = self.Session()
-        server = session.query(Server).filter_by(domain=domain).first()
+        server = self.registry.server(domain)
         if not server:
             return
 
-        release_date = session.query(Mastodon).first().updated
-        days_passed = (self.utcnow() - release_date).days
+        days_passed = (self.utcnow() - self.registry.release_date).days
 
         for admin in server.admins:
             if admin.update_type == UpdateType.stable and self.is_rc(release):
@@ -249,8 +416,6 @@ class MastodonManager():
                 language='ko'
             )
 
-        session.close()
-
     def notify_new_version(self, release: str):
         self.post(
             f'새로운 마스토돈 {release}가 릴리즈 되었어요!!\n'
@@ -259,8 +424,7 @@ class MastodonManager():
             language='ko',
         )
 
-        session = self.Session()
-        for admin in session.query(Admin).all():
+        for admin in self.registry.all_admins():
             if admin.update_type == UpdateType.stable and self.is_rc(release):
                 continue
 
@@ -272,8 +436,6 @@ class MastodonManager():
                 language='ko'
             )
 
-        session.close()
-
     @functools.wraps(mastodon.Mastodon.status_post)
     def post(self, status, *args, **kwargs):
         if self.debug:
@@ -286,11 +448,10 @@ class MastodonManager():
 
     @staticmethod
     def is_rc(release):
-        return '-rc' in release or '-beta' in release
+        return policy.is_rc(release)
 
-    @staticmethod
-    def utcnow():
-        return datetime.datetime.now(datetime.timezone.utc)
+    def utcnow(self):
+        return self.clock()
 
     @staticmethod
     def get_server_version(domain: str):
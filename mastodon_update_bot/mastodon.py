@@ -7,25 +7,31 @@ import httpx
 import mastodon
 
 from lxml import html
+from packaging import version
 
-from .models import Admin, Server, get_or_create, UpdateType
+from . import policy
+from .models import Admin, Mastodon, Server, UpdateType
+from .profiling import profiler
+from .registry import Registry
 
-PATTERN_REGISTER = re.compile(r'\bregister\b')
-PATTERN_UNREGISTER = re.compile(r'\bunregister\b')
-PATTERN_TYPE = re.compile(r'type: (\w+)')
+PATTERN_COMMAND = re.compile(r'\b(register|unregister|status)\b|\btype: (\w+)')
 
 
 class MastodonStreamListener(mastodon.StreamListener):
 
-    def __init__(self, api: mastodon.Mastodon, sessionmaker, debug=False):
+    def __init__(self, api: mastodon.Mastodon, sessionmaker, registry: Registry | None = None, debug=False,
+                 clock=policy.utcnow):
         super().__init__()
         self.api = api
         self.Session = sessionmaker
+        self.registry = registry or Registry()
+        self.clock = clock
         self.logger = logging.getLogger(__name__)
         self.domain = api.instance().uri
 
         self.debug = debug
 
+    @profiler('notification')
     def on_notification(self, notification):
         if notification['type'] == 'follow':
             self.handle_follow(notification)
@@ -45,15 +51,31 @@ class MastodonStreamListener(mastodon.StreamListener):
         content = self.get_plain_content(status)
         self.logger.debug(f'{account["acct"]} is mentioned me: {content}')
 
-        if PATTERN_REGISTER.search(content):
-            self.register(account, status['id'])
-        elif PATTERN_UNREGISTER.search(content):
-            self.unregister(account, status['id'])
-        elif found := PATTERN_TYPE.search(content):
-            update_type = found.group(1)
-            self.change_update_type(account, status['id'], update_type)
+        replies = []
+        for command, update_type in self.parse_commands(content):
+            if command == 'register':
+                replies.append(self.register(account))
+            elif command == 'unregister':
+                replies.append(self.unregister(account))
+            elif command == 'status':
+                replies.append(self.status(account))
+            elif command == 'type':
+                replies.append(self.change_update_type(account, update_type))
+
+        if replies:
+            self.post(
+                f'@{self.full_acct(account)} ' + '\n'.join(replies),
+                visibility='direct', in_reply_to_id=status['id'])
 
-    def register(self, account, reply_id):
+    @staticmethod
+    def parse_commands(content: str) -> list[tuple[str, str | None]]:
+        """Every command in a mention, in order, as (command, argument)."""
+        return [
+            (command, None) if command else ('type', update_type)
+            for command, update_type in PATTERN_COMMAND.findall(content)
+        ]
+
+    def register(self, account) -> str:
         acct = self.full_acct(account)
         domain = self.get_domain(account)
         web_domain = self.get_web_domain(account)
@@ -61,28 +83,27 @@ class MastodonStreamListener(mastodon.StreamListener):
         self.logger.info(f'Registering {acct}')
 
         if not self.is_mastodon(web_domain):
-            self.post(
-                f'@{acct} {web_domain} is not a mastodon instance',
-                visibility='direct', in_reply_to_id=reply_id)
-            return
+            return f'{web_domain} is not a mastodon instance'
 
+        # Server and admin land in one commit, so a sweep never sees a server without its web domain
         session = self.Session()
-        server, created = get_or_create(
-            session, Server,
-            domain=domain,
-            web_domain=web_domain,
-        )
-        admin, created = get_or_create(
-            session, Admin,
-            acct=acct,
-        )
+        server = session.get(Server, domain)
+        if server is None:
+            server = Server(domain=domain)
+            session.add(server)
+        server.web_domain = web_domain
+        admin = session.get(Admin, acct)
+        if admin is None:
+            admin = Admin(acct=acct)
+            session.add(admin)
         admin.server = server
         session.commit()
+        self.registry.register(acct, domain, web_domain, admin.update_type)
         session.close()
 
-        self.post(f'@{acct} 구독 되었습니다', visibility='direct', in_reply_to_id=reply_id)
+        return '구독 되었습니다'
 
-    def unregister(self, account, reply_id):
+    def unregister(self, account) -> str:
         acct = self.full_acct(account)
 
         self.logger.info(f'Unregistering {acct}')
@@ -98,19 +119,18 @@ class MastodonStreamListener(mastodon.StreamListener):
 
             session.commit()
 
+        self.registry.unregister(acct)
         session.close()
 
-        self.post(f'@{acct} 구독 해지 되었습니다', visibility='direct', in_reply_to_id=reply_id)
+        return '구독 해지 되었습니다'
 
-    def change_update_type(self, account, reply_id, update_type):
+    def change_update_type(self, account, update_type) -> str:
         acct = self.full_acct(account)
 
         valid_values = set(item.value for item in UpdateType)
 
         if update_type not in valid_values:
-            self.post(
-                f'@{acct} Invalid type. valid types are {", ".join(valid_values)}',
-                visibility='direct', in_reply_to_id=reply_id)
+            return f'Invalid type. valid types are {", ".join(valid_values)}'
 
         self.logger.info(f'Changing update type of {acct} to {update_type}')
 
@@ -118,18 +138,66 @@ class MastodonStreamListener(mastodon.StreamListener):
         admin = session.query(Admin).filter_by(acct=acct).first()
 
         if not admin:
-            self.post(
-                '@{acct} You are not registered. Please send me "register" to register you.',
-                visibility='direct', in_reply_to_id=reply_id)
+            reply = 'You are not registered. Please send me "register" to register you.'
         else:
             admin.update_type = UpdateType(update_type)
             session.commit()
-            self.post(
-                f'@{acct} Changed update type to {update_type}',
-                visibility='direct', in_reply_to_id=reply_id)
+            self.registry.set_update_type(acct, admin.update_type)
+            reply = f'Changed update type to {update_type}'
+
+        session.close()
+
+        return reply
+
+    def status(self, account) -> str:
+        """Report what the last sweeps stored about the server.
+        Never contacts the instance itself.
+        """
+        acct = self.full_acct(account)
 
+        session = self.Session()
+        admin = session.get(Admin, acct)
+
+        if not admin:
+            session.close()
+            return 'You are not registered. Please send me "register" to register you.'
+
+        server = admin.server
+        release = session.query(Mastodon).first()
+        now = self.clock()
         session.close()
 
+        lines = [
+            f'{server.domain}: {server.version or "unknown"} (fetched {self.format_time(server.last_fetched)})',
+            f'Update type: {admin.update_type.value}',
+        ]
+        if server.tls_expires is not None:
+            lines.append(f'TLS expires in {(server.tls_expires - now).days} days')
+        if server.retry_at is not None:
+            lines.append(f'Unreachable since {self.format_time(server.unreachable_since)}')
+
+        if release is not None:
+            if admin.update_type == UpdateType.stable and policy.is_rc(release.version):
+                lines.append(f'Latest release: {release.version} (no reminders for pre-releases on stable)')
+            elif self.is_outdated(server.version, release.version):
+                next_notify = policy.next_notify(release.updated, server.last_notified)
+                lines.append(f'Next reminder for {release.version}: {self.format_time(max(next_notify, now))}')
+            else:
+                lines.append(f'Latest release: {release.version}')
+
+        return '\n'.join(lines)
+
+    @staticmethod
+    def is_outdated(server_version: str | None, release: str) -> bool:
+        try:
+            return version.parse(server_version) < version.parse(release)
+        except (TypeError, version.InvalidVersion):
+            return False
+
+    @staticmethod
+    def format_time(time) -> str:
+        return time.strftime('%Y-%m-%d %H:%M %Z').strip() if time else 'never'
+
     def full_acct(self, account):
         acct = account.acct
         return acct if '@' in account.acct else f'{acct}@{self.domain}'
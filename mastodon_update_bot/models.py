@@ -1,16 +1,36 @@
+import datetime
 import enum
 
-from sqlalchemy import Column, String, DateTime, ForeignKey, Integer, Enum
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, String, DateTime, ForeignKey, Integer, Enum, TypeDecorator, select, update
+from sqlalchemy.orm import backref, declarative_base, relationship
 
-from typing import TypeVar
+from typing import Iterator, TypeVar
 
 T = TypeVar('T')
 
 Base = declarative_base()
 
 
+class UTCDateTime(TypeDecorator):
+    """Aware UTC datetimes on every backend, including sqlite, which stores
+    them without an offset.
+    """
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc)
+            if dialect.name == 'sqlite':
+                value = value.replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None and value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return value
+
+
 def get_or_create(session, model: T, **kwargs: dict) -> (T, bool):
     """Get or create
     :return: (instance: model, is_created: bool)
@@ -25,12 +45,63 @@ def get_or_create(session, model: T, **kwargs: dict) -> (T, bool):
     return instance, True
 
 
+def iter_servers(sessionmaker, batch_size: int = 500, after: str | None = None) -> Iterator[tuple[str, str]]:
+    """Stream (domain, web_domain) of every server after `after`, ordered by domain.
+    Pages are fetched by keyset on the primary key, each in a short-lived
+    session, so neither rows nor ORM instances pile up in memory.
+    """
+    last_domain = after
+    while True:
+        stmt = select(Server.domain, Server.web_domain).order_by(Server.domain).limit(batch_size)
+        if last_domain is not None:
+            stmt = stmt.where(Server.domain > last_domain)
+
+        with sessionmaker() as session:
+            rows = session.execute(stmt).all()
+
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last_domain = rows[-1].domain
+
+
+def claim_notification(session, domain: str, column, last_notified, now) -> bool:
+    """Atomically stamp `column` of the server with `now`, as long as it still
+    holds `last_notified`. Only the caller that wins the claim should post,
+    so overlapping sweeps or processes never notify twice.
+    :return: whether the claim succeeded
+    """
+    result = session.execute(
+        update(Server)
+        .where(Server.domain == domain, column.is_not_distinct_from(last_notified))
+        .values({column: now})
+    )
+    session.commit()
+    return result.rowcount == 1
+
+
+def record_version(session, domain: str, version: str) -> bool:
+    """Store the fetched `version` of the server and clear its `last_notified`,
+    only if the stored version differs. A sweep holding a stale copy of the
+    server can then never wipe a claim made after another sweep's upgrade.
+    The caller commits.
+    :return: whether the version changed
+    """
+    result = session.execute(
+        update(Server)
+        .where(Server.domain == domain, Server.version.is_distinct_from(version))
+        .values(version=version, last_notified=None)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
 class Mastodon(Base):
     __tablename__ = 'mastodon'
 
     id = Column(Integer, primary_key=True)
     version = Column(String, nullable=False)
-    updated = Column(DateTime(timezone=True))
+    updated = Column(UTCDateTime(timezone=True))
 
     def __repr__(self):
         return f'<{self.__class__.__name__} {self.version} {self.updated}>'
@@ -43,14 +114,60 @@ class Server(Base):
     domain = Column(String, primary_key=True)
     web_domain = Column(String)
     version = Column(String)
-    last_fetched = Column(DateTime(timezone=True))
-    last_notified = Column(DateTime(timezone=True))
-    last_tls_notified = Column(DateTime(timezone=True))
+    last_fetched = Column(UTCDateTime(timezone=True))
+    last_notified = Column(UTCDateTime(timezone=True))
+    last_tls_notified = Column(UTCDateTime(timezone=True))
+    tls_expires = Column(UTCDateTime(timezone=True))
+    failures = Column(Integer, default=0, server_default='0', nullable=False)
+    retry_at = Column(UTCDateTime(timezone=True))
+    unreachable_since = Column(UTCDateTime(timezone=True))
+    last_unreachable_notified = Column(UTCDateTime(timezone=True))
 
     def __repr__(self):
         return f'<{self.__class__.__name__} {self.domain} {self.version} ({self.last_fetched})>'
 
 
+class FailureReason(enum.Enum):
+    dns = 'dns'
+    timeout = 'timeout'
+    connect = 'connect'
+    tls = 'tls'
+    http = 'http'
+    json = 'json'
+    other = 'other'
+
+
+class ServerFailure(Base):
+
+    __tablename__ = 'server_failures'
+
+    domain = Column(String, ForeignKey(Server.domain, ondelete='CASCADE'), primary_key=True)
+    reason = Column(Enum(FailureReason, native_enum=False), primary_key=True)
+    count = Column(Integer, default=0, nullable=False)
+    last_failed = Column(UTCDateTime(timezone=True))
+    server = relationship(
+        Server, backref=backref('failure_counts', cascade='all, delete-orphan'))
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.domain} {self.reason.value}: {self.count}>'
+
+
+class Sweep(Base):
+
+    __tablename__ = 'sweeps'
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    release = Column(String)
+    started = Column(UTCDateTime(timezone=True))
+    finished = Column(UTCDateTime(timezone=True))
+    # Every server up to and including this one has been processed
+    last_domain = Column(String)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.id} {self.kind} ({self.last_domain})>'
+
+
 class UpdateType(enum.Enum):
     all = 'all'
     stable = 'stable'
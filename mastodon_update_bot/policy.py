@@ -0,0 +1,55 @@
+"""Reminder schedule, kept free of database and network access."""
+import datetime
+import functools
+import math
+
+from packaging import version
+
+
+def utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_version(release: str) -> version.Version:
+    """`packaging.version.parse`, memoized since every sweep parses the same few versions."""
+    return version.parse(release)
+
+
+def is_rc(release: str) -> bool:
+    return '-rc' in release or '-beta' in release
+
+
+def _level(days: int) -> float:
+    # 0, 1, 2, 4, 8
+    return math.log(days, 2) if days > 0 else -1
+
+
+def should_notify(release_date: datetime.datetime, last_notified: datetime.datetime | None,
+                  now: datetime.datetime) -> bool:
+    """Remind on the 1st, 2nd, 4th, 8th... day after the release."""
+    # Days from release to now
+    days_passed = (now - release_date).days
+
+    if last_notified is None:
+        return days_passed >= 1
+
+    # Days from release to last notified
+    days_notified = (last_notified - release_date).days
+
+    return _level(days_passed) - _level(days_notified) >= 1 and days_passed >= 1
+
+
+def next_notify(release_date: datetime.datetime,
+                last_notified: datetime.datetime | None) -> datetime.datetime:
+    """When `should_notify` turns true next."""
+    days_notified = (last_notified - release_date).days if last_notified is not None else 0
+    return release_date + datetime.timedelta(days=max(days_notified * 2, 1))
+
+
+def should_notify_tls(last_notified: datetime.datetime | None, now: datetime.datetime) -> bool:
+    if last_notified is None:
+        return True
+
+    days_notified = (now - last_notified).days
+    return days_notified >= 1
@@ -0,0 +1,97 @@
+"""On-demand cProfile and tracemalloc capture of sweeps.
+
+Set `PROFILE=1` to profile every wrapped run, or send SIGUSR1 to profile
+only the next one. Results go to `PROFILE_DIR` as `.pstats` and
+`.tracemalloc` files, and the top `PROFILE_TOP` entries are logged.
+When disarmed, a wrapped call costs one attribute check.
+"""
+import cProfile
+import datetime
+import functools
+import io
+import logging
+import os
+import pathlib
+import pstats
+import signal
+import threading
+import tracemalloc
+
+PROFILE = os.getenv('PROFILE', 'False').lower() not in ('false', '0', 'no')
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_TOP = int(os.getenv('PROFILE_TOP', '20'))
+
+
+class Profiler():
+
+    def __init__(self, directory: str, top: int, always: bool = False):
+        self.directory = pathlib.Path(directory)
+        self.top = top
+        self.always = always
+        self.armed = always
+        self.logger = logging.getLogger(__name__)
+        # cProfile can only run one profile at a time
+        self.lock = threading.Lock()
+
+    def arm(self, *args):
+        """Profile the next wrapped run. Usable as a signal handler."""
+        self.logger.info('Profiling the next run')
+        self.armed = True
+
+    def install_signal_handler(self, signum=signal.SIGUSR1):
+        signal.signal(signum, self.arm)
+
+    def __call__(self, name: str):
+        """Decorator profiling the wrapped function while armed."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.armed or not self.lock.acquire(blocking=False):
+                    return func(*args, **kwargs)
+                try:
+                    self.armed = self.always
+                    return self.profile(name, func, *args, **kwargs)
+                finally:
+                    self.lock.release()
+            return wrapper
+        return decorator
+
+    def profile(self, name: str, func, *args, **kwargs):
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        profile = cProfile.Profile()
+
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, tracemalloc.__file__),
+            ])
+            current, peak = tracemalloc.get_traced_memory()
+            if not tracing:
+                tracemalloc.stop()
+            self.save(name, profile, snapshot, peak)
+
+    def save(self, name: str, profile: cProfile.Profile, snapshot: tracemalloc.Snapshot, peak: int):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stem = self.directory / f'{name}-{datetime.datetime.now():%Y%m%d-%H%M%S}'
+
+        profile.dump_stats(f'{stem}.pstats')
+        snapshot.dump(f'{stem}.tracemalloc')
+
+        stream = io.StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(self.top)
+        self.logger.info(f'Profile of {name} saved to {stem}.pstats\n{stream.getvalue()}')
+
+        allocations = '\n'.join(str(stat) for stat in snapshot.statistics('lineno')[:self.top])
+        self.logger.info(
+            f'Top allocations of {name} (peak {peak / 1024 / 1024:.1f} MiB) saved to {stem}.tracemalloc\n'
+            f'{allocations}'
+        )
+
+
+profiler = Profiler(PROFILE_DIR, PROFILE_TOP, always=PROFILE)
@@ -0,0 +1,143 @@
+"""Process-local copy of the servers, admins and latest release.
+
+Sweeps and notifications read from here instead of querying the database.
+`MastodonStreamListener` applies its changes after committing them, and
+`Registry.reconcile` reloads everything from the database periodically.
+"""
+import datetime
+import logging
+import threading
+
+from sqlalchemy import select
+
+from .models import Admin, Mastodon, Server, UpdateType
+
+
+class AdminRecord():
+    __slots__ = ('acct', 'domain', 'update_type')
+
+    def __init__(self, acct: str, domain: str, update_type: UpdateType):
+        self.acct = acct
+        self.domain = domain
+        self.update_type = update_type
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.acct}>'
+
+
+class ServerRecord():
+    __slots__ = ('domain', 'web_domain', 'admins')
+
+    def __init__(self, domain: str, web_domain: str, admins: tuple[AdminRecord, ...] = ()):
+        self.domain = domain
+        self.web_domain = web_domain
+        # Replaced, never mutated, so readers always see a consistent tuple
+        self.admins = admins
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.domain}>'
+
+
+class Registry():
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        # Writers hold the lock, readers rely on dict lookups being atomic
+        self.lock = threading.RLock()
+        self.servers: dict[str, ServerRecord] = {}
+        self.admins: dict[str, AdminRecord] = {}
+        self.release: str | None = None
+        self.release_date: datetime.datetime | None = None
+
+    def server(self, domain: str) -> ServerRecord | None:
+        return self.servers.get(domain)
+
+    def admins_of(self, domain: str) -> tuple[AdminRecord, ...]:
+        server = self.servers.get(domain)
+        return server.admins if server else ()
+
+    def all_admins(self) -> list[AdminRecord]:
+        return list(self.admins.values())
+
+    def load(self, sessionmaker):
+        """Replace the whole registry with the database contents.
+        :return: number of servers and admins that differed
+        """
+        with self.lock, sessionmaker() as session:
+            servers = {
+                domain: ServerRecord(domain, web_domain)
+                for domain, web_domain in session.execute(select(Server.domain, Server.web_domain))
+            }
+            admins = {}
+            for acct, domain, update_type in session.execute(select(Admin.acct, Admin.domain, Admin.update_type)):
+                admins[acct] = AdminRecord(acct, domain, update_type)
+                if domain in servers:
+                    servers[domain].admins += (admins[acct],)
+            release = session.execute(select(Mastodon.version, Mastodon.updated)).first()
+
+            drift = self.diff(servers, admins)
+            self.servers = servers
+            self.admins = admins
+            if release is not None:
+                self.release, self.release_date = release
+
+        return drift
+
+    def reconcile(self, sessionmaker):
+        drift = self.load(sessionmaker)
+        if drift:
+            self.logger.warning(f'Registry was out of sync with the database on {drift} records')
+
+    def diff(self, servers: dict[str, ServerRecord], admins: dict[str, AdminRecord]) -> int:
+        """Number of servers and admins that are missing on either side or differ."""
+        drift = len(self.servers.keys() ^ servers.keys()) + len(self.admins.keys() ^ admins.keys())
+        drift += sum(
+            1 for domain, server in servers.items()
+            if domain in self.servers
+            and (self.servers[domain].web_domain, {admin.acct for admin in self.servers[domain].admins})
+            != (server.web_domain, {admin.acct for admin in server.admins})
+        )
+        drift += sum(
+            1 for acct, admin in admins.items()
+            if acct in self.admins
+            and (self.admins[acct].domain, self.admins[acct].update_type) != (admin.domain, admin.update_type)
+        )
+        return drift
+
+    def set_release(self, release: str, release_date: datetime.datetime):
+        with self.lock:
+            self.release = release
+            self.release_date = release_date
+
+    def register(self, acct: str, domain: str, web_domain: str, update_type: UpdateType):
+        with self.lock:
+            self._remove_admin(acct)
+            server = self.servers.get(domain)
+            if server is None:
+                server = self.servers[domain] = ServerRecord(domain, web_domain)
+            server.web_domain = web_domain
+
+            admin = self.admins[acct] = AdminRecord(acct, domain, update_type)
+            server.admins += (admin,)
+
+    def unregister(self, acct: str):
+        with self.lock:
+            self._remove_admin(acct)
+
+    def set_update_type(self, acct: str, update_type: UpdateType):
+        with self.lock:
+            admin = self.admins.get(acct)
+            if admin is not None:
+                admin.update_type = update_type
+
+    def _remove_admin(self, acct: str):
+        admin = self.admins.pop(acct, None)
+        if admin is None:
+            return
+
+        server = self.servers.get(admin.domain)
+        if server is None:
+            return
+        server.admins = tuple(item for item in server.admins if item.acct != acct)
+        if not server.admins:
+            del self.servers[admin.domain]
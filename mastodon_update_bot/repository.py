@@ -0,0 +1,133 @@
+"""Async data access for the bot, on top of SQLAlchemy's asyncio extension.
+
+Every function takes an `AsyncSession` (see `engine.get_async_session`) and
+loads relationships eagerly, since lazy loading is not available on an
+asyncio connection.
+"""
+import datetime
+
+from sqlalchemy import delete, inspect, literal_column, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from .models import Admin, Mastodon, Server, UpdateType
+
+from typing import TypeVar
+
+T = TypeVar('T')
+
+INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+
+async def get_or_create(session: AsyncSession, model: T, **kwargs: dict) -> (T, bool):
+    """Get or create with `INSERT ... ON CONFLICT DO UPDATE` on the primary key,
+    a single round trip on postgres.
+    Columns other than the primary key are overwritten with `kwargs`.
+    :return: (instance: model, is_created: bool)
+    """
+    dialect = session.get_bind().dialect.name
+    insert = INSERTS[dialect]
+    primary_key = [column.name for column in inspect(model).primary_key]
+
+    created = None
+    if dialect != 'postgresql':
+        # SQLite has no xmax to tell an insert from an update, so the
+        # created flag costs a lookup there
+        existing = select(*inspect(model).primary_key).filter_by(**{key: kwargs[key] for key in primary_key})
+        created = (await session.execute(existing)).first() is None
+
+    # Updating the conflicting row makes RETURNING yield it
+    stmt = insert(model).values(**kwargs)
+    updates = [key for key in kwargs if key not in primary_key] or primary_key
+    stmt = stmt.on_conflict_do_update(
+        index_elements=primary_key,
+        set_={key: stmt.excluded[key] for key in updates},
+    )
+
+    if created is None:
+        # A freshly inserted tuple is the only one with no deleting xact
+        stmt = stmt.returning(model, literal_column('xmax = 0'))
+        result = await session.execute(stmt, execution_options={'populate_existing': True})
+        instance, created = result.one()
+    else:
+        result = await session.execute(stmt.returning(model), execution_options={'populate_existing': True})
+        instance = result.scalar_one()
+
+    await session.commit()
+    return instance, created
+
+
+async def get_release(session: AsyncSession) -> Mastodon | None:
+    return (await session.execute(select(Mastodon))).scalars().first()
+
+
+async def set_release(session: AsyncSession, version: str, updated: datetime.datetime) -> Mastodon:
+    mastodon = await get_release(session)
+    if mastodon is None:
+        mastodon = Mastodon()
+        session.add(mastodon)
+
+    mastodon.version = version
+    mastodon.updated = updated
+    await session.commit()
+    return mastodon
+
+
+async def get_server(session: AsyncSession, domain: str) -> Server | None:
+    stmt = select(Server).filter_by(domain=domain).options(selectinload(Server.admins))
+    return (await session.execute(stmt)).scalars().first()
+
+
+async def list_servers(session: AsyncSession) -> list[Server]:
+    return list((await session.execute(select(Server))).scalars())
+
+
+async def update_server(session: AsyncSession, domain: str, **values):
+    await session.execute(update(Server).filter_by(domain=domain).values(**values))
+    await session.commit()
+
+
+async def get_admin(session: AsyncSession, acct: str) -> Admin | None:
+    stmt = select(Admin).filter_by(acct=acct).options(selectinload(Admin.server))
+    return (await session.execute(stmt)).scalars().first()
+
+
+async def list_admins(session: AsyncSession) -> list[Admin]:
+    return list((await session.execute(select(Admin))).scalars())
+
+
+async def register_admin(session: AsyncSession, acct: str, domain: str, web_domain: str) -> Admin:
+    await get_or_create(session, Server, domain=domain, web_domain=web_domain)
+    admin, created = await get_or_create(session, Admin, acct=acct, domain=domain)
+    return admin
+
+
+async def unregister_admin(session: AsyncSession, acct: str) -> bool:
+    """Delete the admin, and its server once nobody is subscribed to it.
+    :return: whether the admin was registered
+    """
+    admin = await get_admin(session, acct)
+    if admin is None:
+        return False
+
+    domain = admin.domain
+    await session.delete(admin)
+    await session.flush()
+
+    remaining = await session.execute(select(Admin.acct).filter_by(domain=domain).limit(1))
+    if remaining.first() is None:
+        await session.execute(delete(Server).filter_by(domain=domain))
+
+    await session.commit()
+    return True
+
+
+async def set_update_type(session: AsyncSession, acct: str, update_type: UpdateType) -> bool:
+    """:return: whether the admin was registered"""
+    result = await session.execute(update(Admin).filter_by(acct=acct).values(update_type=update_type))
+    await session.commit()
+    return result.rowcount > 0
@@ -0,0 +1,380 @@
+"""Dry-run the bot's sweeps against synthetic servers.
+
+Runs the real `MastodonManager.job` and `ssl_check_job`, and through them
+`check_and_notify`, `check_tls_and_notify` and the notifications, on a
+simulated clock. The release feed, instance fetches, TLS probes and posts
+are in-memory fakes, and so is the stored state: the manager's load, save
+and claim hooks are served from `ServerState` records instead of SQL.
+
+A sweep only checks the servers whose check could change anything, e.g.
+an outdated server once its next reminder is due or its upgrade lands.
+Months of sweeps over thousands of servers then take seconds. Usage::
+
+    python -m mastodon_update_bot.simulate --servers 3000 --days 180
+"""
+import argparse
+import bisect
+import collections
+import datetime
+import heapq
+import logging
+import random
+
+import requests
+
+from . import health, policy
+from .manager import MastodonManager
+from .models import UpdateType
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+CERT_LIFETIME = datetime.timedelta(days=90)
+BASE_VERSION = 'v3.5.0'
+
+
+class SimulatedClock():
+
+    def __init__(self, now: datetime.datetime = START):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, delta: datetime.timedelta):
+        self.now += delta
+
+
+class SimulatedServer():
+    """The instance itself, as seen over the network."""
+    __slots__ = ('domain', 'upgrade_lag', 'dead', 'tls_expires', 'renew_before')
+
+    def __init__(self, domain, upgrade_lag, dead, tls_expires, renew_before):
+        self.domain = domain
+        # Days from a release until the server runs it, None to never upgrade
+        self.upgrade_lag = upgrade_lag
+        self.dead = dead
+        self.tls_expires = tls_expires
+        self.renew_before = renew_before
+
+
+class ServerState():
+    """What the bot stores about a server, in place of a `Server` row."""
+    __slots__ = (
+        'domain', 'web_domain', 'version', 'last_fetched', 'last_notified', 'last_tls_notified', 'tls_expires',
+        'failures', 'retry_at', 'unreachable_since', 'last_unreachable_notified',
+    )
+
+    def __init__(self, domain: str, version: str):
+        self.domain = self.web_domain = domain
+        self.version = version
+        self.last_fetched = self.last_notified = self.last_tls_notified = self.tls_expires = None
+        self.failures = 0
+        self.retry_at = self.unreachable_since = self.last_unreachable_notified = None
+
+
+class SimulatedManager(MastodonManager):
+    """`MastodonManager` whose network access and storage are served by a `Simulation`."""
+
+    def __init__(self, simulation: 'Simulation', unreachable_notice_days=0):
+        self.simulation = simulation
+        self.release = None
+        # Never connected to, every storage hook is overridden
+        super().__init__(
+            'sqlite://', '', '', unreachable_notice_days=unreachable_notice_days, clock=simulation.clock)
+
+    def connect(self, domain: str, token: str):
+        pass
+
+    def fetch_release(self):
+        return self.simulation.latest_release()
+
+    def fetch_version(self, web_domain: str) -> str:
+        return self.simulation.fetch_version(web_domain)
+
+    def fetch_tls_expires(self, domain: str, web_domain: str) -> datetime.datetime:
+        return self.simulation.probe_tls(domain)
+
+    def load_release(self):
+        return self.release
+
+    def save_release(self, release: str, updated):
+        self.release = (release, updated)
+
+    def load_server(self, domain: str) -> ServerState | None:
+        return self.simulation.states.get(domain)
+
+    def save_version(self, domain: str, server_version: str):
+        state = self.simulation.states[domain]
+        if state.version != server_version:
+            state.version = server_version
+            state.last_notified = None
+        state.last_fetched = self.utcnow()
+        health.record_success(state)
+        return state.last_notified
+
+    def save_tls_expires(self, domain: str, expires: datetime.datetime):
+        state = self.simulation.states[domain]
+        state.tls_expires = expires
+        return state.last_tls_notified
+
+    def save_failure(self, domain: str, reason, now: datetime.datetime) -> ServerState:
+        state = self.simulation.states[domain]
+        health.count_failure(state, now)
+        return state
+
+    def claim_notification(self, domain: str, column, last_notified) -> bool:
+        state = self.simulation.states[domain]
+        if getattr(state, column.key) != last_notified:
+            return False
+        setattr(state, column.key, self.utcnow())
+        return True
+
+    def sweep(self, kind: str, release: str | None = None, sweep_id: int | None = None):
+        self.simulation.sweep(self, kind, release)
+
+    def post(self, status, *args, **kwargs):
+        self.simulation.post()
+
+
+class Simulation():
+
+    def __init__(self, servers: int, days: int, seed: int = 0,
+                 sweep_interval=datetime.timedelta(hours=1),
+                 tls_interval=datetime.timedelta(hours=2),
+                 release_interval: float = 30, rc_ratio: float = 0.3, dead_ratio: float = 0.02,
+                 window=datetime.timedelta(hours=3), every_server: bool = False):
+        self.random = random.Random(seed)
+        self.clock = SimulatedClock()
+        self.end = START + datetime.timedelta(days=days)
+        self.sweep_interval = sweep_interval
+        self.tls_interval = tls_interval
+        self.window = window
+
+        self.releases = self.make_releases(release_interval, rc_ratio)
+        self.release_dates = [released for released, _ in self.releases]
+        self.servers = {
+            server.domain: server
+            for server in (self.make_server(index, dead_ratio) for index in range(servers))
+        }
+        self.states = {domain: ServerState(domain, BASE_VERSION) for domain in self.servers}
+
+        # (due, domain) of the servers whose next check could change anything
+        self.due = {'job': [], 'ssl_check_job': [(START, domain) for domain in sorted(self.servers)]}
+        self.swept_release = None
+        # Check every server on every sweep, like the bot does, to verify the shortcut
+        self.every_server = every_server
+
+        self.checks = 0
+        self.posts_per_day = collections.Counter()
+        self.posts_per_sweep = []
+
+    def make_releases(self, interval: float, rc_ratio: float) -> list[tuple[datetime.datetime, str]]:
+        releases = []
+        released = START
+        while released < self.end:
+            name = f'v4.{len(releases)}.0'
+            if self.random.random() < rc_ratio:
+                name += '-rc1'
+            releases.append((released, name))
+            released += datetime.timedelta(days=self.random.expovariate(1 / interval))
+        return releases
+
+    def make_server(self, index: int, dead_ratio: float) -> SimulatedServer:
+        upgrade_lag = None if self.random.random() < 0.05 else self.random.expovariate(1 / 7)
+        dead = self.random.random() < dead_ratio
+        tls_expires = START + CERT_LIFETIME * self.random.random()
+        # Most certificates are renewed well ahead, a few only at the last moment
+        renew_before = self.random.choice([30, 30, 30, 30, 14, 3, 0])
+
+        return SimulatedServer(f'server{index}.example', upgrade_lag, dead, tls_expires, renew_before)
+
+    def seed(self, manager: MastodonManager):
+        for domain in self.servers:
+            manager.registry.register(f'admin@{domain}', domain, domain, (
+                UpdateType.all if self.random.random() < 0.3 else UpdateType.stable))
+            while self.random.random() < 0.1:
+                manager.registry.register(
+                    f'admin{self.random.getrandbits(32)}@{domain}', domain, domain, UpdateType.stable)
+
+    def release_at(self, when: datetime.datetime) -> int:
+        """Index of the latest release published by `when`, -1 before the first one."""
+        return bisect.bisect_right(self.release_dates, when) - 1
+
+    def latest_release(self) -> tuple[str, datetime.datetime]:
+        released, name = self.releases[self.release_at(self.clock())]
+        return name, released
+
+    def fetch_version(self, domain: str) -> str:
+        server = self.servers[domain]
+        if server.dead:
+            raise requests.ConnectionError(f'{domain} is down')
+        if server.upgrade_lag is None:
+            return BASE_VERSION
+
+        running = self.release_at(self.clock() - datetime.timedelta(days=server.upgrade_lag))
+        return self.releases[running][1] if running >= 0 else BASE_VERSION
+
+    def probe_tls(self, domain: str) -> datetime.datetime:
+        server = self.servers[domain]
+        if server.dead:
+            raise requests.ConnectionError(f'{domain} is down')
+
+        now = self.clock()
+        if server.tls_expires - now <= datetime.timedelta(days=server.renew_before):
+            server.tls_expires = now + CERT_LIFETIME
+        return server.tls_expires
+
+    def post(self):
+        self.posts_per_day[self.clock().date()] += 1
+        started, posts = self.posts_per_sweep[-1]
+        self.posts_per_sweep[-1] = (started, posts + 1)
+
+    def sweep(self, manager: MastodonManager, kind: str, release: str | None):
+        """Run the manager's check of `kind` on every server that is due."""
+        now = self.clock()
+        if kind == 'job':
+            if release != self.swept_release:
+                # Every server is behind a new release until fetched again
+                self.swept_release = release
+                self.due['job'] = [(now, domain) for domain in sorted(self.servers)]
+            check, due_at = manager.check_and_notify, self.job_due
+            extra = (release,)
+        else:
+            check, due_at = manager.check_tls_and_notify, self.tls_due
+            extra = ()
+
+        due = self.due[kind]
+        if self.every_server:
+            due[:] = [(now, domain) for domain in sorted(self.servers)]
+        checked = []
+        while due and due[0][0] <= now:
+            _, domain = heapq.heappop(due)
+            check(domain, domain, *extra)
+            checked.append(domain)
+        self.checks += len(checked)
+
+        for domain in checked:
+            when = due_at(manager, domain, now)
+            if when is not None:
+                heapq.heappush(due, (when, domain))
+
+    def job_due(self, manager: MastodonManager, domain: str, now: datetime.datetime) -> datetime.datetime | None:
+        """When `check_and_notify` can next do more than refresh `last_fetched`."""
+        state = self.states[domain]
+        if health.is_open(state, now):
+            return state.retry_at
+        server = self.servers[domain]
+        if server.dead:
+            return now
+        if policy.parse_version(state.version) >= policy.parse_version(self.swept_release):
+            # Nothing to remind about until the next release
+            return None
+
+        remind = policy.next_notify(manager.registry.release_date, state.last_notified)
+        if server.upgrade_lag is None:
+            return remind
+        upgrade = self.release_at(now - datetime.timedelta(days=server.upgrade_lag)) + 1
+        if upgrade >= len(self.releases):
+            return remind
+        return min(remind, self.releases[upgrade][0] + datetime.timedelta(days=server.upgrade_lag))
+
+    def tls_due(self, manager: MastodonManager, domain: str, now: datetime.datetime) -> datetime.datetime | None:
+        """When `check_tls_and_notify` can next renew or warn about the certificate."""
+        server = self.servers[domain]
+        if server.dead:
+            # Failed probes are only logged
+            return None
+        if server.tls_expires - now >= datetime.timedelta(days=8):
+            return server.tls_expires - datetime.timedelta(days=max(server.renew_before, 8))
+
+        # Within the last week, until the renewal only the daily warnings count
+        renew = server.tls_expires - datetime.timedelta(days=server.renew_before)
+        last_notified = self.states[domain].last_tls_notified
+        return renew if last_notified is None else min(renew, last_notified + datetime.timedelta(days=1))
+
+    def run(self, manager: MastodonManager):
+        next_job = next_tls = self.clock()
+        while self.clock() < self.end:
+            now = self.clock()
+            if now >= next_job:
+                self.posts_per_sweep.append((now, 0))
+                manager.job()
+                next_job += self.sweep_interval
+            if now >= next_tls:
+                self.posts_per_sweep.append((now, 0))
+                manager.ssl_check_job()
+                next_tls += self.tls_interval
+            self.clock.advance(min(next_job, next_tls) - now)
+
+    def peak_window(self) -> int:
+        """Most posts sent within any `window`, as rate limits count them."""
+        peak = posts = start = 0
+        for started, count in self.posts_per_sweep:
+            posts += count
+            while self.posts_per_sweep[start][0] <= started - self.window:
+                posts -= self.posts_per_sweep[start][1]
+                start += 1
+            peak = max(peak, posts)
+        return peak
+
+    def report(self) -> str:
+        days = max((self.end - START).days, 1)
+        daily = [self.posts_per_day[(START + datetime.timedelta(days=day)).date()] for day in range(days)]
+        busiest = max(range(days), key=daily.__getitem__)
+        return '\n'.join([
+            f'Servers: {len(self.servers)}, days: {days}, releases: {len(self.releases)}, checks: {self.checks}',
+            f'Posts: {sum(daily)} total, {sum(daily) / days:.1f} per day',
+            f'Busiest day: {(START + datetime.timedelta(days=busiest)).date()} with {daily[busiest]} posts',
+            f'Peak burst: {max((posts for _, posts in self.posts_per_sweep), default=0)} posts in one sweep, '
+            f'{self.peak_window()} posts within {self.window}',
+        ])
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'{value} is not a positive integer')
+    return number
+
+
+def simulate(servers: int, days: int, unreachable_notice_days: int = 0, **kwargs) -> Simulation:
+    simulation = Simulation(servers, days, **kwargs)
+    manager = SimulatedManager(simulation, unreachable_notice_days=unreachable_notice_days)
+    simulation.seed(manager)
+    simulation.run(manager)
+    return simulation
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--servers', type=positive_int, default=3000)
+    parser.add_argument('--days', type=positive_int, default=180)
+    parser.add_argument('--sweep-hours', type=float, default=1, help='hours between version sweeps')
+    parser.add_argument('--tls-hours', type=float, default=2, help='hours between TLS sweeps')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--release-interval', type=float, default=30, help='mean days between releases')
+    parser.add_argument('--rc-ratio', type=float, default=0.3)
+    parser.add_argument('--dead-ratio', type=float, default=0.02, help='share of servers that never respond')
+    parser.add_argument('--unreachable-notice-days', type=int, default=0)
+    parser.add_argument('--window-hours', type=float, default=3, help='rate limit window of the peak burst')
+    parser.add_argument('--daily', action='store_true', help='print posts of every day')
+    args = parser.parse_args()
+
+    # The manager logs every failed probe and notification
+    logging.getLogger('mastodon_update_bot').setLevel(logging.ERROR)
+
+    simulation = simulate(
+        args.servers, args.days, unreachable_notice_days=args.unreachable_notice_days,
+        seed=args.seed, sweep_interval=datetime.timedelta(hours=args.sweep_hours),
+        tls_interval=datetime.timedelta(hours=args.tls_hours),
+        release_interval=args.release_interval, rc_ratio=args.rc_ratio, dead_ratio=args.dead_ratio,
+        window=datetime.timedelta(hours=args.window_hours),
+    )
+
+    if args.daily:
+        for day, posts in sorted(simulation.posts_per_day.items()):
+            print(f'{day} {posts}')
+    print(simulation.report())
+
+
+if __name__ == '__main__':
+    main()
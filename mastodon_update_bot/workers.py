@@ -0,0 +1,132 @@
+import logging
+import os
+import queue
+import threading
+import time
+import traceback
+
+from typing import Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+# How often blocked queue operations look at the stop event
+POLL_INTERVAL = 0.5
+
+
+class Stop(threading.Event):
+    """Event that remembers when it was first set."""
+
+    def __init__(self):
+        super().__init__()
+        self.set_at: float | None = None
+
+    def set(self):
+        if self.set_at is None:
+            self.set_at = time.monotonic()
+        super().set()
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def run_bounded(func: Callable, iterable: Iterable[tuple], workers: int | None = None, backlog: int | None = None,
+                stop: Stop | None = None, deadline: float | None = None,
+                on_progress: Callable[[tuple], None] | None = None) -> tuple | None:
+    """Call `func(*args)` for every args in `iterable` on a pool of threads.
+
+    Unlike `ThreadPool.starmap`, `iterable` is consumed lazily: at most
+    `backlog` items wait in the queue at any time, so a streaming source is
+    never materialized as a whole.
+
+    Once `stop` is set, queued items are dropped and in-flight calls get
+    `deadline` seconds, counted from when `stop` was set, to finish before
+    the pool is abandoned.
+
+    :return: the last args such that it and everything before it finished,
+        also reported to `on_progress` whenever it advances
+    """
+    workers = workers or default_workers()
+    backlog = backlog or workers * 2
+    stop = stop or Stop()
+    tasks = queue.Queue(maxsize=backlog)
+
+    lock = threading.Lock()
+    finished = {}
+    watermark = [-1, None]
+
+    def complete(index, args):
+        with lock:
+            finished[index] = args
+            if index != watermark[0] + 1:
+                return
+            while watermark[0] + 1 in finished:
+                watermark[0] += 1
+                watermark[1] = finished.pop(watermark[0])
+            if on_progress is None:
+                return
+            # A failing callback must not take the worker down with it
+            try:
+                on_progress(watermark[1])
+            except Exception:
+                logger.error(traceback.format_exc())
+
+    def worker():
+        while not stop.is_set():
+            try:
+                task = tasks.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if task is _DONE or stop.is_set():
+                return
+            index, args = task
+            try:
+                func(*args)
+            except Exception:
+                logger.error(traceback.format_exc())
+            complete(index, args)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for task in enumerate(iterable):
+            if not _put(tasks, task, stop, threads):
+                break
+    finally:
+        # Once stopped, workers leave on their own
+        for _ in threads:
+            if not _put(tasks, _DONE, stop, threads):
+                break
+        _join(threads, stop, deadline)
+
+    if any(thread.is_alive() for thread in threads):
+        logger.warning('Abandoned in-flight work after the shutdown deadline')
+
+    with lock:
+        return watermark[1]
+
+
+def _put(tasks: queue.Queue, item, stop: Stop, threads: list[threading.Thread]) -> bool:
+    """Put `item` unless `stop` is set first, or no worker is left to take it.
+    :return: whether `item` was queued
+    """
+    while not stop.is_set():
+        try:
+            tasks.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            if not any(thread.is_alive() for thread in threads):
+                logger.error('Every worker died, giving up on the remaining work')
+                return False
+    return False
+
+
+def _join(threads: list[threading.Thread], stop: Stop, deadline: float | None):
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(POLL_INTERVAL)
+            if stop.is_set() and deadline is not None and time.monotonic() - stop.set_at >= deadline:
+                return
@@ -0,0 +1,93 @@
+import types
+
+import pytest
+import requests
+from mastodon import AttribAccessDict
+
+from mastodon_update_bot.engine import get_session, init_db
+from mastodon_update_bot.manager import MastodonManager
+from mastodon_update_bot.mastodon import MastodonStreamListener
+
+
+class FakeApi():
+
+    def instance(self):
+        return types.SimpleNamespace(uri='bot.example')
+
+
+def account(acct: str, web_domain: str | None = None):
+    domain = acct.split('@')[1]
+    # Mastodon.py hands out accounts with both item and attribute access
+    return AttribAccessDict(acct=acct, url=f'https://{web_domain or domain}/@{acct.split("@")[0]}')
+
+
+class FakeManager(MastodonManager):
+    """Manager whose instances run `versions[web_domain]` with certificates
+    expiring at `tls_expires[web_domain]`, and whose posts are collected in
+    `posts`. Missing instances fail to respond.
+    """
+
+    def __init__(self, db_url: str, **kwargs):
+        self.versions = {}
+        self.tls_expires = {}
+        self.posts = []
+        super().__init__(db_url, '', '', **kwargs)
+
+    def connect(self, domain: str, token: str):
+        pass
+
+    def fetch_version(self, web_domain: str) -> str:
+        if web_domain not in self.versions:
+            raise requests.ConnectionError(f'{web_domain} is down')
+        return self.versions[web_domain]
+
+    def fetch_tls_expires(self, domain: str, web_domain: str):
+        if web_domain not in self.tls_expires:
+            raise requests.ConnectionError(f'{web_domain} is down')
+        return self.tls_expires[web_domain]
+
+    def post(self, status, *args, **kwargs):
+        self.posts.append(status)
+
+
+@pytest.fixture
+def db_url(tmp_path):
+    url = f'sqlite:///{tmp_path / "test.db"}'
+    init_db(url)
+    return url
+
+
+@pytest.fixture
+def sessionmaker(db_url):
+    session = get_session(db_url)
+    yield session
+    session.kw['bind'].dispose()
+
+
+class FakeListener(MastodonStreamListener):
+    """Listener that takes every domain for a mastodon instance and collects
+    its posts in `posts` as (status, kwargs).
+    """
+
+    def __init__(self, sessionmaker, **kwargs):
+        self.posts = []
+        super().__init__(FakeApi(), sessionmaker, **kwargs)
+
+    @staticmethod
+    def is_mastodon(web_domain: str):
+        return True
+
+    def post(self, status, *args, **kwargs):
+        self.posts.append((status, kwargs))
+
+
+@pytest.fixture
+def listener(sessionmaker):
+    return FakeListener(sessionmaker)
+
+
+@pytest.fixture
+def manager(db_url):
+    manager = FakeManager(db_url)
+    yield manager
+    manager.Session.kw['bind'].dispose()
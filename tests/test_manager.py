@@ -0,0 +1,185 @@
+import datetime
+
+from mastodon_update_bot import health
+from mastodon_update_bot import manager as manager_module
+from mastodon_update_bot.models import Admin, FailureReason, Mastodon, Server, Sweep
+from mastodon_update_bot.workers import Stop
+
+NOW = datetime.datetime(2024, 1, 10, tzinfo=datetime.timezone.utc)
+
+
+def seed(manager, release='v4.3.0', released=NOW - datetime.timedelta(days=3), version='v4.2.0',
+         last_notified=None):
+    with manager.Session() as session:
+        session.add(Mastodon(version=release, updated=released))
+        session.add(Server(domain='a.example', web_domain='a.example', version=version, last_notified=last_notified))
+        session.add(Admin(acct='admin@a.example', domain='a.example'))
+        session.commit()
+    manager.registry.load(manager.Session)
+    manager.clock = lambda: NOW
+
+
+def test_overlapping_checks_notify_once(manager):
+    # Reminded on the old version, so an upgrade has a claim to reset
+    seed(manager, version='v4.1.0', last_notified=NOW - datetime.timedelta(days=1))
+    versions = iter(['v4.2.0', 'v4.2.0'])
+
+    def fetch_version(web_domain):
+        fetched = next(versions)
+        if manager.versions:
+            # Sweep A runs to the end while sweep B holds the server it loaded before the upgrade
+            manager.versions = {}
+            manager.check_and_notify('a.example', 'a.example', 'v4.3.0')
+        return fetched
+
+    manager.versions = {'a.example': 'v4.2.0'}
+    manager.fetch_version = fetch_version
+    manager.check_and_notify('a.example', 'a.example', 'v4.3.0')
+
+    assert len(manager.posts) == 1
+    with manager.Session() as session:
+        server = session.get(Server, 'a.example')
+        assert server.version == 'v4.2.0'
+        assert server.last_notified == NOW
+
+
+def test_upgrade_resets_last_notified(manager):
+    seed(manager)
+    manager.versions = {'a.example': 'v4.2.0'}
+    manager.check_and_notify('a.example', 'a.example', 'v4.3.0')
+    assert len(manager.posts) == 1
+
+    # The same version again keeps the claim, a new one starts the schedule over
+    manager.check_and_notify('a.example', 'a.example', 'v4.3.0')
+    assert len(manager.posts) == 1
+
+    manager.versions = {'a.example': 'v4.2.1'}
+    manager.check_and_notify('a.example', 'a.example', 'v4.3.0')
+    assert len(manager.posts) == 2
+
+
+def test_tls_warning_is_sent_once_a_day(manager):
+    seed(manager)
+    manager.tls_expires = {'a.example': NOW + datetime.timedelta(days=5)}
+
+    manager.check_tls_and_notify('a.example', 'a.example')
+    manager.check_tls_and_notify('a.example', 'a.example')
+    assert len(manager.posts) == 1
+
+    manager.clock = lambda: NOW + datetime.timedelta(days=1)
+    manager.check_tls_and_notify('a.example', 'a.example')
+    assert len(manager.posts) == 2
+
+    with manager.Session() as session:
+        server = session.get(Server, 'a.example')
+        assert server.tls_expires == NOW + datetime.timedelta(days=5)
+        assert server.last_tls_notified == NOW + datetime.timedelta(days=1)
+
+
+def test_failures_open_the_breaker(manager):
+    seed(manager)
+    manager.unreachable_notice = datetime.timedelta(days=0)
+
+    for _ in range(health.FAILURE_THRESHOLD):
+        manager.check_and_notify('a.example', 'a.example', 'v4.3.0')
+
+    with manager.Session() as session:
+        server = session.get(Server, 'a.example')
+        assert server.failures == health.FAILURE_THRESHOLD
+        assert server.retry_at == NOW + health.backoff(server.failures)
+        assert server.unreachable_since == NOW
+        assert [(failure.reason, failure.count) for failure in server.failure_counts] == [
+            (FailureReason.connect, health.FAILURE_THRESHOLD)]
+    # Only the first failure past the notice period is announced
+    assert len(manager.posts) == 1
+
+    # An open breaker skips the server, a later success closes it
+    manager.versions = {'a.example': 'v4.3.0'}
+    manager.check_and_notify('a.example', 'a.example', 'v4.3.0')
+    assert manager.load_server('a.example').failures == health.FAILURE_THRESHOLD
+
+    manager.clock = lambda: NOW + health.backoff(health.FAILURE_THRESHOLD)
+    manager.check_and_notify('a.example', 'a.example', 'v4.3.0')
+    server = manager.load_server('a.example')
+    assert (server.failures, server.retry_at, server.version) == (0, None, 'v4.3.0')
+
+
+def seed_servers(manager, count=20):
+    domains = [f'server{index:02}.example' for index in range(count)]
+    with manager.Session() as session:
+        session.add(Mastodon(version='v4.3.0', updated=NOW - datetime.timedelta(days=3)))
+        for domain in domains:
+            session.add(Server(domain=domain, web_domain=domain, version='v4.3.0'))
+        session.commit()
+    manager.registry.load(manager.Session)
+    manager.clock = lambda: NOW
+    manager.workers = 1
+    manager.versions = {domain: 'v4.3.0' for domain in domains}
+    return domains
+
+
+def record_fetches(manager, stop_after=None):
+    fetched = []
+    fetch_version = manager.fetch_version
+
+    def fetch(web_domain):
+        fetched.append(web_domain)
+        if len(fetched) == stop_after:
+            manager.stopping.set()
+        return fetch_version(web_domain)
+
+    manager.fetch_version = fetch
+    return fetched
+
+
+def get_sweeps(manager):
+    with manager.Session() as session:
+        return session.query(Sweep).order_by(Sweep.id).all()
+
+
+def test_interrupted_sweep_resumes_after_checkpoint(manager, monkeypatch):
+    monkeypatch.setattr(manager_module, 'CHECKPOINT_INTERVAL', 0)
+    domains = seed_servers(manager)
+
+    fetched = record_fetches(manager, stop_after=8)
+    manager.sweep('job', 'v4.3.0')
+    assert fetched == domains[:8]
+
+    [sweep] = get_sweeps(manager)
+    assert (sweep.kind, sweep.release, sweep.finished, sweep.last_domain) == ('job', 'v4.3.0', None, domains[7])
+
+    # The restarted process picks the sweep up where it stopped
+    manager.stopping = Stop()
+    fetched = record_fetches(manager)
+    manager.resume_sweeps()
+    assert fetched == domains[8:]
+
+    [sweep] = get_sweeps(manager)
+    assert sweep.finished == NOW
+    assert sweep.last_domain == domains[-1]
+
+
+def test_resume_closes_older_sweeps_of_the_same_kind(manager):
+    domains = seed_servers(manager)
+    manager.tls_expires = {domain: NOW + datetime.timedelta(days=60) for domain in domains}
+    with manager.Session() as session:
+        session.add_all([
+            Sweep(kind='job', release='v4.2.0', started=NOW - datetime.timedelta(hours=2), last_domain=domains[2]),
+            Sweep(kind='job', release='v4.3.0', started=NOW - datetime.timedelta(hours=1), last_domain=domains[4]),
+            Sweep(kind='ssl_check_job', started=NOW - datetime.timedelta(hours=1)),
+            Sweep(kind='job', release='v4.1.0', started=NOW - datetime.timedelta(hours=3), finished=NOW),
+        ])
+        session.commit()
+
+    fetched = record_fetches(manager)
+    manager.resume_sweeps()
+    # Only the newest job sweep is resumed, from its checkpoint
+    assert fetched == domains[5:]
+
+    older, newer, tls, done = get_sweeps(manager)
+    assert older.finished == NOW and older.last_domain == domains[2]
+    assert newer.finished == NOW and newer.last_domain == domains[-1]
+    assert tls.finished == NOW and tls.last_domain == domains[-1]
+    assert done.finished == NOW
+    with manager.Session() as session:
+        assert all(server.tls_expires is not None for server in session.query(Server))
@@ -0,0 +1,107 @@
+import datetime
+
+from mastodon_update_bot.mastodon import MastodonStreamListener
+from mastodon_update_bot.models import Admin, Mastodon, Server, UpdateType
+
+from .conftest import account
+
+NOW = datetime.datetime(2024, 1, 10, tzinfo=datetime.timezone.utc)
+
+
+def set_release(sessionmaker, release: str, released=NOW - datetime.timedelta(days=3)):
+    with sessionmaker() as session:
+        session.add(Mastodon(version=release, updated=released))
+        session.commit()
+
+
+def set_server(sessionmaker, domain: str, **values):
+    with sessionmaker() as session:
+        server = session.get(Server, domain)
+        for key, value in values.items():
+            setattr(server, key, value)
+        session.commit()
+
+
+def mention(acct: str, content: str, status_id=1):
+    return {
+        'type': 'mention',
+        'account': account(acct),
+        'status': {'id': status_id, 'content': f'<p><a href="https://bot.example/@bot">@bot</a> {content}</p>'},
+    }
+
+
+def test_parse_commands():
+    assert MastodonStreamListener.parse_commands('register type: all status unregister') == [
+        ('register', None), ('type', 'all'), ('status', None), ('unregister', None),
+    ]
+    assert MastodonStreamListener.parse_commands('type: nightly') == [('type', 'nightly')]
+    # Commands are whole words only
+    assert MastodonStreamListener.parse_commands('registered, statuses') == []
+
+
+def test_mention_batches_replies_in_order(listener, sessionmaker):
+    listener.on_notification(mention('admin@a.example', 'register<br>type: all<br>status', status_id=42))
+
+    assert len(listener.posts) == 1
+    status, kwargs = listener.posts[0]
+    assert kwargs == {'visibility': 'direct', 'in_reply_to_id': 42}
+
+    lines = status.splitlines()
+    assert lines[0] == '@admin@a.example 구독 되었습니다'
+    assert lines[1] == 'Changed update type to all'
+    assert lines[2].startswith('a.example: unknown')
+    assert lines[3] == 'Update type: all'
+
+    with sessionmaker() as session:
+        assert session.get(Admin, 'admin@a.example').update_type == UpdateType.all
+
+
+def test_mention_with_invalid_type_runs_the_other_commands(listener, sessionmaker):
+    listener.on_notification(mention('admin@a.example', 'register type: nightly status'))
+
+    assert len(listener.posts) == 1
+    lines = listener.posts[0][0].splitlines()
+    assert lines[0] == '@admin@a.example 구독 되었습니다'
+    assert lines[1].startswith('Invalid type. valid types are ')
+    assert lines[2].startswith('a.example: unknown')
+    assert lines[3] == 'Update type: stable'
+
+
+def test_mention_without_commands_is_not_answered(listener):
+    listener.on_notification(mention('admin@a.example', 'hello'))
+    assert listener.posts == []
+
+
+def test_status_skips_reminder_for_rc_on_stable(listener, sessionmaker):
+    listener.register(account('admin@a.example'))
+    set_server(sessionmaker, 'a.example', version='v4.2.0')
+    set_release(sessionmaker, 'v4.3.0-rc1')
+
+    status = listener.status(account('admin@a.example'))
+    assert 'Next reminder' not in status
+    assert 'Latest release: v4.3.0-rc1 (no reminders for pre-releases on stable)' in status
+
+
+def test_status_reminds_for_rc_on_all(listener, sessionmaker):
+    listener.clock = lambda: NOW
+    listener.register(account('admin@a.example'))
+    listener.change_update_type(account('admin@a.example'), 'all')
+    set_server(sessionmaker, 'a.example', version='v4.2.0')
+    set_release(sessionmaker, 'v4.3.0-rc1')
+
+    # Never reminded, so the first reminder is already due
+    assert 'Next reminder for v4.3.0-rc1: 2024-01-10 00:00 UTC' in listener.status(account('admin@a.example'))
+
+
+def test_status_reminds_for_stable_release(listener, sessionmaker):
+    listener.clock = lambda: NOW
+    listener.register(account('admin@a.example'))
+    # Reminded on the 2nd day after the release, so the next one is on the 4th
+    set_server(sessionmaker, 'a.example', version='v4.2.0', last_notified=NOW - datetime.timedelta(days=1))
+    set_release(sessionmaker, 'v4.3.0')
+
+    assert 'Next reminder for v4.3.0: 2024-01-11 00:00 UTC' in listener.status(account('admin@a.example'))
+
+
+def test_status_of_unregistered_account(listener):
+    assert listener.status(account('admin@a.example')).startswith('You are not registered.')
@@ -0,0 +1,117 @@
+import time
+
+from sqlalchemy import event, select
+
+from mastodon_update_bot.models import Admin, Server, UpdateType
+from mastodon_update_bot.registry import AdminRecord, Registry, ServerRecord
+
+from .conftest import account
+
+
+def snapshot(registry: Registry):
+    servers = {
+        domain: (server.web_domain, sorted(admin.acct for admin in server.admins))
+        for domain, server in registry.servers.items()
+    }
+    admins = {acct: (admin.domain, admin.update_type) for acct, admin in registry.admins.items()}
+    return servers, admins
+
+
+def assert_in_sync(listener, sessionmaker):
+    fresh = Registry()
+    fresh.load(sessionmaker)
+    assert snapshot(listener.registry) == snapshot(fresh)
+    assert listener.registry.diff(fresh.servers, fresh.admins) == 0
+
+
+def test_listener_keeps_registry_in_sync(listener, sessionmaker):
+    listener.registry.load(sessionmaker)
+
+    steps = [
+        lambda: listener.register(account('one@a.example')),
+        lambda: listener.register(account('two@a.example')),
+        lambda: listener.register(account('three@b.example', 'web.b.example')),
+        lambda: listener.change_update_type(account('one@a.example'), 'all'),
+        lambda: listener.change_update_type(account('nobody@c.example'), 'all'),
+        lambda: listener.unregister(account('two@a.example')),
+        # Re-registering from a new home moves the admin
+        lambda: listener.register(account('one@a.example', 'new.a.example')),
+        lambda: listener.unregister(account('three@b.example')),
+        lambda: listener.unregister(account('nobody@c.example')),
+    ]
+    for step in steps:
+        step()
+        assert_in_sync(listener, sessionmaker)
+
+    assert snapshot(listener.registry) == (
+        {'a.example': ('new.a.example', ['one@a.example'])},
+        {'one@a.example': ('a.example', UpdateType.all)},
+    )
+
+
+def test_load_reports_drift(listener, sessionmaker):
+    listener.register(account('one@a.example'))
+    listener.register(account('two@a.example'))
+    listener.registry.load(sessionmaker)
+    assert listener.registry.load(sessionmaker) == 0
+
+    with sessionmaker() as session:
+        session.get(Server, 'a.example').web_domain = 'web.a.example'
+        session.delete(session.get(Admin, 'two@a.example'))
+        session.commit()
+
+    # The changed server, and the deleted admin
+    assert listener.registry.load(sessionmaker) == 2
+
+
+def test_diff_counts_membership(listener):
+    one = AdminRecord('one@a.example', 'a.example', UpdateType.stable)
+    two = AdminRecord('two@a.example', 'a.example', UpdateType.stable)
+    registry = listener.registry
+    registry.servers = {'a.example': ServerRecord('a.example', 'a.example', (one,))}
+    registry.admins = {one.acct: one}
+
+    assert registry.diff({'a.example': ServerRecord('a.example', 'a.example', (one, two))}, {one.acct: one}) == 1
+    assert registry.diff({'a.example': ServerRecord('a.example', 'web.a.example', (one,))}, {one.acct: one}) == 1
+
+
+def test_admins_of_is_faster_than_a_query(sessionmaker):
+    domains = [f'server{index}.example' for index in range(1000)]
+    with sessionmaker() as session:
+        for domain in domains:
+            session.add(Server(domain=domain, web_domain=domain))
+            session.add(Admin(acct=f'admin@{domain}', domain=domain))
+        session.commit()
+
+    registry = Registry()
+    registry.load(sessionmaker)
+
+    started = time.perf_counter()
+    for domain in domains:
+        assert len(registry.admins_of(domain)) == 1
+    lookups = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with sessionmaker() as session:
+        for domain in domains:
+            assert len(session.scalars(select(Admin).filter_by(domain=domain)).all()) == 1
+    queries = time.perf_counter() - started
+
+    print(f'admins_of: {lookups / len(domains) * 1e6:.2f} us, query: {queries / len(domains) * 1e6:.2f} us')
+    assert lookups * 10 < queries
+
+
+def test_register_commits_server_and_admin_at_once(listener, sessionmaker):
+    commits = []
+
+    def after_commit(session):
+        commits.append(session)
+
+    event.listen(sessionmaker, 'after_commit', after_commit)
+    listener.register(account('one@a.example', 'web.a.example'))
+    assert len(commits) == 1
+
+    with sessionmaker() as session:
+        server = session.get(Server, 'a.example')
+        assert server.web_domain == 'web.a.example'
+        assert [admin.acct for admin in server.admins] == ['one@a.example']
@@ -0,0 +1,64 @@
+import asyncio
+
+from sqlalchemy import select
+
+from mastodon_update_bot import repository
+from mastodon_update_bot.engine import get_async_session, init_db_async
+from mastodon_update_bot.models import Admin, Server
+
+
+def run(tmp_path, test):
+    url = f'sqlite:///{tmp_path / "test.db"}'
+
+    async def main():
+        await init_db_async(url)
+        async with get_async_session(url)() as session:
+            await test(session)
+
+    asyncio.run(main())
+
+
+def test_get_or_create(tmp_path):
+    async def test(session):
+        server, created = await repository.get_or_create(session, Server, domain='a.example', web_domain='a.example')
+        assert created
+        assert server.web_domain == 'a.example'
+
+        server, created = await repository.get_or_create(
+            session, Server, domain='a.example', web_domain='web.a.example')
+        assert not created
+        assert server.web_domain == 'web.a.example'
+
+        servers = (await session.execute(select(Server))).scalars().all()
+        assert [server.domain for server in servers] == ['a.example']
+
+    run(tmp_path, test)
+
+
+def test_register_admin_moves_to_new_server(tmp_path):
+    async def test(session):
+        await repository.register_admin(session, 'admin@a.example', 'a.example', 'a.example')
+        admin = await repository.register_admin(session, 'admin@a.example', 'b.example', 'b.example')
+        assert admin.domain == 'b.example'
+
+        server = await repository.get_server(session, 'b.example')
+        assert [admin.acct for admin in server.admins] == ['admin@a.example']
+
+    run(tmp_path, test)
+
+
+def test_unregister_admin(tmp_path):
+    async def test(session):
+        await repository.register_admin(session, 'one@a.example', 'a.example', 'a.example')
+        await repository.register_admin(session, 'two@a.example', 'a.example', 'a.example')
+
+        assert await repository.unregister_admin(session, 'one@a.example')
+        assert await repository.get_server(session, 'a.example') is not None
+
+        assert await repository.unregister_admin(session, 'two@a.example')
+        assert await repository.get_server(session, 'a.example') is None
+        assert (await session.execute(select(Admin))).first() is None
+
+        assert not await repository.unregister_admin(session, 'two@a.example')
+
+    run(tmp_path, test)
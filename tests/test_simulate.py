@@ -0,0 +1,27 @@
+import argparse
+
+import pytest
+
+from mastodon_update_bot import simulate
+
+
+def test_skipping_servers_changes_no_post():
+    # Frequent releases and many dead servers exercise reminders, upgrades and the breaker
+    kwargs = dict(release_interval=5, dead_ratio=0.1, unreachable_notice_days=2)
+    fast = simulate.simulate(40, 30, **kwargs)
+    full = simulate.simulate(40, 30, every_server=True, **kwargs)
+
+    assert fast.checks < full.checks / 10
+    assert sum(fast.posts_per_day.values()) > 0
+    assert fast.posts_per_sweep == full.posts_per_sweep
+
+
+def test_report():
+    report = simulate.simulate(10, 1).report()
+    assert report.startswith('Servers: 10, days: 1, ')
+
+
+def test_positive_int():
+    assert simulate.positive_int('3') == 3
+    with pytest.raises(argparse.ArgumentTypeError):
+        simulate.positive_int('0')
@@ -0,0 +1,73 @@
+import threading
+import time
+
+from mastodon_update_bot.workers import Stop, run_bounded
+
+
+def test_run_bounded_runs_everything():
+    done = []
+    lock = threading.Lock()
+
+    def func(number):
+        with lock:
+            done.append(number)
+
+    assert run_bounded(func, ((number,) for number in range(100)), workers=4) == (99,)
+    assert sorted(done) == list(range(100))
+
+
+def test_run_bounded_stops_within_deadline():
+    stop = Stop()
+    threading.Timer(0.5, stop.set).start()
+
+    started = time.monotonic()
+    # Both workers are stuck and the queue is full, so the producer waits on it
+    last = run_bounded(lambda number: time.sleep(8), ((number,) for number in range(100)),
+                       workers=2, stop=stop, deadline=1)
+    elapsed = time.monotonic() - started
+
+    assert last is None
+    assert 1.5 <= elapsed < 3
+
+
+def test_run_bounded_stops_idle_workers():
+    stop = Stop()
+    threading.Timer(0.5, stop.set).start()
+
+    def numbers():
+        # A source that stalls, like a slow page fetch
+        yield (0,)
+        stop.wait()
+        yield (1,)
+
+    started = time.monotonic()
+    assert run_bounded(lambda number: None, numbers(), workers=2, stop=stop, deadline=5) == (0,)
+    assert time.monotonic() - started < 2
+
+
+def test_stop_remembers_first_set():
+    stop = Stop()
+    assert stop.set_at is None
+    stop.set()
+    set_at = stop.set_at
+    stop.set()
+    assert stop.set_at == set_at
+
+
+def test_run_bounded_survives_failing_progress():
+    done = []
+    lock = threading.Lock()
+
+    def func(number):
+        with lock:
+            done.append(number)
+
+    def on_progress(args):
+        raise RuntimeError('database is locked')
+
+    started = time.monotonic()
+    last = run_bounded(func, ((number,) for number in range(50)), workers=2, on_progress=on_progress)
+
+    assert time.monotonic() - started < 5
+    assert last == (49,)
+    assert sorted(done) == list(range(50))